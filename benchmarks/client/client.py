@@ -2,29 +2,111 @@ import argparse
 import logging
 import time
 import asyncio
+import httpx
 import openai
-import json
-import io
+import orjson
 import traceback
 
 
-from typing import List
-from utils import (load_workload, wrap_prompt_as_chat_message)
+from typing import List, Optional
+from utils import (load_workload, wrap_prompt_as_chat_message, AsyncJsonlWriter)
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
 
 logging.basicConfig(level=logging.INFO)
 
 
+async def run_with_limit(semaphore: Optional[asyncio.Semaphore], coro):
+    # Optionally cap the number of requests in flight. Requests start their timer
+    # once admitted, so time spent waiting here is not part of latency/ttft and is
+    # only recorded as queue_delay against their scheduled_time.
+    if semaphore is None:
+        return await coro
+    async with semaphore:
+        return await coro
+
+
+async def dispatch_workload(send_request,
+                            request_type: str,
+                            client: openai.AsyncOpenAI,
+                            load_struct: List,
+                            output_file: AsyncJsonlWriter,
+                            max_inflight: Optional[int]):
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(max_inflight) if max_inflight is not None else None
+    inflight_tasks = set()
+    all_done = asyncio.Event()
+    num_requests = sum(len(requests_dict["requests"]) for requests_dict in load_struct)
+    num_completed = 0
+
+    def on_request_done(task: asyncio.Task):
+        nonlocal num_completed
+        # Finished tasks drop out of the set; a batch still creates all of its
+        # tasks as soon as it launches.
+        inflight_tasks.discard(task)
+        num_completed += 1
+        if num_completed == num_requests:
+            all_done.set()
+
+    def launch(batch: List, target_time: float, scheduled_time: float, first_request_id: int):
+        logging.warning(f"Launching {len(batch)} {request_type} tasks, {loop.time() - target_time:.3f}s behind schedule")
+        for i, (model, formatted_prompt) in enumerate(batch):
+            task = asyncio.create_task(
+                run_with_limit(semaphore,
+                               send_request(client = client, 
+                                            model = model, 
+                                            prompt = formatted_prompt, 
+                                            output_file = output_file, 
+                                            request_id = first_request_id + i,
+                                            scheduled_time = scheduled_time))
+            )
+            inflight_tasks.add(task)
+            task.add_done_callback(on_request_done)
+
+    # Build every batch's request arguments before any timer is registered, so a
+    # malformed workload fails here instead of inside a timer callback.
+    batches = []
+    for requests_dict in load_struct:
+        requests = requests_dict["requests"]
+        if not requests:
+            continue
+        batch = [(request["model"], wrap_prompt_as_chat_message(request["prompt"])) for request in requests]
+        batches.append((int(requests_dict["timestamp"]), batch))
+
+    # A failing writer ends the wait; close() below then re-raises its error.
+    output_file.start(on_error=all_done.set)
+    # Register every batch with the event loop timer up front, so launches fire at
+    # their absolute target times instead of waiting on a sleeping scheduler loop.
+    # Timers run on the loop clock, but recorded timestamps use time.monotonic(): with
+    # uvloop, loop.time() only has millisecond resolution.
+    base_time = loop.time()
+    base_monotonic = time.monotonic()
+    request_id = 0
+    for ts, batch in batches:
+        target_time = base_time + ts / 1000.0
+        loop.call_at(target_time, launch, batch, target_time, base_monotonic + ts / 1000.0, request_id)
+        request_id += len(batch)
+    logging.warning(f"Scheduled {num_requests} {request_type} requests in {len(load_struct)} batches")
+    if num_requests > 0:
+        await all_done.wait()
+    await output_file.close()
+    logging.warning(f"All {num_requests} requests completed for deployment.")
+
+
 async def send_request_streaming(client: openai.AsyncOpenAI, 
                              model: str, 
-                             endpoint: str, 
                              prompt: str, 
-                             output_file: str,
-                             request_id: int):
-    start_time = asyncio.get_event_loop().time()
+                             output_file: AsyncJsonlWriter,
+                             request_id: int,
+                             scheduled_time: float):
+    start_time = time.monotonic()
     first_response_time = None
     target_pod = ""
     try:
-        logging.info(f"Request {request_id}: Starting streaming request to {endpoint}")
+        logging.info("Request %d: Starting streaming request", request_id)
         response_stream = await client.chat.completions.create(
             model=model,
             messages=prompt,
@@ -46,7 +128,7 @@ async def send_request_streaming(client: openai.AsyncOpenAI,
                 if chunk.choices:
                     if chunk.choices[0].delta.content is not None:
                         if not first_response_time:
-                            first_response_time = asyncio.get_event_loop().time()
+                            first_response_time = time.monotonic()
                         output_text = chunk.choices[0].delta.content
                         text_chunks.append(output_text)
                 if hasattr(chunk, 'usage') and chunk.usage is not None:
@@ -63,7 +145,7 @@ async def send_request_streaming(client: openai.AsyncOpenAI,
             logging.error(f"Request {request_id}: Stream interrupted: {type(stream_error).__name__}: {str(stream_error)}")
         
         response_text = "".join(text_chunks)
-        response_time = asyncio.get_event_loop().time()
+        response_time = time.monotonic()
         latency = response_time - start_time
         throughput = output_tokens / latency if output_tokens > 0 else 0
         ttft = first_response_time - start_time if first_response_time else None
@@ -79,6 +161,8 @@ async def send_request_streaming(client: openai.AsyncOpenAI,
             "total_tokens": total_tokens,
             "latency": latency,
             "throughput": throughput,
+            "scheduled_time": scheduled_time,
+            "queue_delay": start_time - scheduled_time,
             "start_time": start_time,
             "end_time": response_time,
             "ttft": ttft,
@@ -87,13 +171,12 @@ async def send_request_streaming(client: openai.AsyncOpenAI,
         }
         
         # Write result to JSONL file
-        logging.info(f"Request {request_id}: Completed successfully. Tokens: {total_tokens}, Latency: {latency:.2f}s")
-        output_file.write(json.dumps(result) + "\n")
-        output_file.flush()  # Ensure data is written immediately to the file
+        logging.info("Request %d: Completed successfully. Tokens: %d, Latency: %.2fs", request_id, total_tokens, latency)
+        await output_file.write(result)
         return result
         
     except Exception as e:
-        error_time = asyncio.get_event_loop().time()
+        error_time = time.monotonic()
         # Determine error type based on exception class
         error_type = type(e).__name__
         error_result = {
@@ -104,72 +187,56 @@ async def send_request_streaming(client: openai.AsyncOpenAI,
             "error_traceback": traceback.format_exc(),
             "input": prompt,
             "latency": error_time - start_time,
+            "scheduled_time": scheduled_time,
+            "queue_delay": start_time - scheduled_time,
             "start_time": start_time,
             "end_time": error_time,
             "target_pod": target_pod,
         }
         logging.error(f"Request {request_id}: Error ({error_type}): {str(e)}")
-        output_file.write(json.dumps(error_result) + "\n")
-        output_file.flush()
+        await output_file.write(error_result)
         return error_result
 
 async def benchmark_streaming(client: openai.AsyncOpenAI,
-                              endpoint: str,  
                               load_struct: List,
-                              output_file: io.TextIOWrapper):
-    request_id = 0
-    batch_tasks = []
-    base_time = time.time()
-    num_requests = 0
-    for requests_dict in load_struct:
-        ts = int(requests_dict["timestamp"])
-        requests = requests_dict["requests"]
-        cur_time = time.time()
-        target_time = base_time + ts / 1000.0
-        logging.warning(f"Prepare to launch {len(requests)} streaming tasks after {target_time - cur_time}")
-        if target_time > cur_time:
-            await asyncio.sleep(target_time - cur_time)
-        formatted_prompts = [wrap_prompt_as_chat_message(request["prompt"]) for request in requests]
-        for i in range(len(requests)):
-            task = asyncio.create_task(
-                send_request_streaming(client = client, 
-                                       model = requests[i]["model"], 
-                                       endpoint = endpoint, 
-                                       prompt = formatted_prompts[i], 
-                                       output_file = output_file, 
-                                       request_id = request_id)
-            )
-            request_id += 1
-            batch_tasks.append(task)
-        num_requests += len(requests)
-    await asyncio.gather(*batch_tasks)
-    logging.warning(f"All {num_requests} requests completed for deployment.")
+                              output_file: AsyncJsonlWriter,
+                              max_inflight: Optional[int]):
+    await dispatch_workload(send_request = send_request_streaming,
+                            request_type = "streaming",
+                            client = client,
+                            load_struct = load_struct,
+                            output_file = output_file,
+                            max_inflight = max_inflight)
     
 # Asynchronous request handler
 async def send_request_batch(client: openai.AsyncOpenAI,
                              model: str,
                              prompt: str, 
-                             output_file: str, 
-                             request_id: int):
-    start_time = asyncio.get_event_loop().time()
+                             output_file: AsyncJsonlWriter, 
+                             request_id: int,
+                             scheduled_time: float):
+    start_time = time.monotonic()
     target_pod = ""
     try:
-        response = await client.chat.completions.create(
+        # Use the raw response so only the fields we record are read from the body,
+        # skipping construction of the full pydantic ChatCompletion object.
+        raw_response = await client.chat.completions.with_raw_response.create(
             model=model,
             messages=prompt,
             temperature=0,
             max_tokens=2048
         )
-        if hasattr(response, 'response') and hasattr(response.response, 'headers'):
-            target_pod = response.response.headers.get('target-pod')
+        target_pod = raw_response.headers.get('target-pod', "")
 
-        response_time = asyncio.get_event_loop().time()
+        response_time = time.monotonic()
         latency = response_time - start_time
-        prompt_tokens = response.usage.prompt_tokens
-        output_tokens = response.usage.completion_tokens
-        total_tokens = response.usage.total_tokens
+        response = orjson.loads(raw_response.content)
+        usage = response["usage"]
+        prompt_tokens = usage["prompt_tokens"]
+        output_tokens = usage["completion_tokens"]
+        total_tokens = usage["total_tokens"]
         throughput = output_tokens / latency
-        output_text = response.choices[0].message.content
+        output_text = response["choices"][0]["message"]["content"]
 
         result = {
             "request_id": request_id,
@@ -181,20 +248,21 @@ async def send_request_batch(client: openai.AsyncOpenAI,
             "total_tokens": total_tokens,
             "latency": latency,
             "throughput": throughput,
+            "scheduled_time": scheduled_time,
+            "queue_delay": start_time - scheduled_time,
             "start_time": start_time,
             "end_time": response_time,
             "ttft": "Unknown",
             "tpot": "Unknown", 
             "target_pod": target_pod,
         }
-        logging.info(result)
+        logging.info("Request %d: Completed successfully. Tokens: %d, Latency: %.2fs", request_id, total_tokens, latency)
         # Write result to JSONL file
-        output_file.write(json.dumps(result) + "\n")
-        output_file.flush()  # Ensure data is written immediately to the file
+        await output_file.write(result)
         return result
     
     except Exception as e:
-        error_time = asyncio.get_event_loop().time()
+        error_time = time.monotonic()
         error_type = type(e).__name__
         error_result = {
             "request_id": request_id,
@@ -204,56 +272,69 @@ async def send_request_batch(client: openai.AsyncOpenAI,
             "error_traceback": traceback.format_exc(),
             "input": prompt,
             "latency": error_time - start_time,
+            "scheduled_time": scheduled_time,
+            "queue_delay": start_time - scheduled_time,
             "start_time": start_time,
             "end_time": error_time,
             "target_pod": target_pod
         }
         logging.error(f"Request {request_id}: Error ({error_type}): {str(e)}")
-        output_file.write(json.dumps(error_result) + "\n")
-        output_file.flush()
+        await output_file.write(error_result)
         return error_result
 
 
 async def benchmark_batch(client: openai.AsyncOpenAI,
-                          endpoint: str, 
                           load_struct: List, 
-                          output_file: io.TextIOWrapper):
-    request_id = 0
-    batch_tasks = []
-    base_time = time.time()
-    num_requests = 0
-    for requests_dict in load_struct:
-        ts = int(requests_dict["timestamp"])
-        requests = requests_dict["requests"]
-        cur_time = time.time()
-        target_time = base_time + ts / 1000.0
-        logging.warning(f"Prepare to launch {len(requests)} batched tasks after {target_time - cur_time}")
-        if target_time > cur_time:
-            await asyncio.sleep(target_time - cur_time)
-        formatted_prompts = [wrap_prompt_as_chat_message(request["prompt"]) for request in requests]
-        for i in range(len(requests)):
-            task = asyncio.create_task(
-                send_request_batch(client = client, 
-                                   model = requests[i]["model"], 
-                                   endpoint = endpoint, 
-                                   formatted_prompt = formatted_prompts[i], 
-                                   output_file = output_file, 
-                                   request_id = request_id)
-            )
-            request_id += 1
-            batch_tasks.append(task)
-        num_requests += len(requests)
-    await asyncio.gather(*batch_tasks)
-    logging.warning(f"All {num_requests} requests completed for deployment.")
+                          output_file: AsyncJsonlWriter,
+                          max_inflight: Optional[int]):
+    await dispatch_workload(send_request = send_request_batch,
+                            request_type = "batched",
+                            client = client,
+                            load_struct = load_struct,
+                            output_file = output_file,
+                            max_inflight = max_inflight)
+
+
+def run_event_loop(coro):
+    # Prefer the libuv based loop when available, it schedules the many
+    # concurrent request coroutines noticeably faster than the default loop.
+    if uvloop is not None:
+        if hasattr(uvloop, "run"):
+            return uvloop.run(coro)
+        # uvloop.run was added in 0.18; older releases only provide the loop policy.
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return asyncio.run(coro)
 
 
 def main(args):
-    logging.info(f"Starting benchmark on endpoint {args.endpoint}")
-    with open(args.output_file_path, 'w', encoding='utf-8') as output_file:
+    endpoint = args.endpoint.rstrip("/")
+    if not endpoint.startswith(("http://", "https://")):
+        endpoint = "http://" + endpoint
+    logging.info(f"Starting benchmark on endpoint {endpoint}")
+    with open(args.output_file_path, 'wb') as f_out:
+        output_file = AsyncJsonlWriter(f_out)
         load_struct = load_workload(args.workload_path)
+        if args.http2:
+            # HTTP/2 multiplexes concurrent requests over a few connections. It is only
+            # negotiated with https endpoints and needs the h2 package (httpx[http2]).
+            limits = httpx.Limits(max_connections=256, max_keepalive_connections=256)
+        else:
+            # Without --max-inflight the pool is unbounded too, so no request waits for a
+            # connection outside of the recorded latency.
+            limits = httpx.Limits(max_connections=args.max_inflight, max_keepalive_connections=args.max_inflight)
+        # Talk to the endpoint directly: no retries, no redirects and no proxy lookup
+        # from the environment, so every recorded latency is a single attempt.
+        transport = httpx.AsyncHTTPTransport(retries=0, http2=args.http2, limits=limits)
+        http_client = openai.DefaultAsyncHttpxClient(
+            transport=transport,
+            follow_redirects=False,
+            trust_env=False,
+        )
         client = openai.AsyncOpenAI(
             api_key=args.api_key,
-            base_url=args.endpoint + "/v1",
+            base_url=endpoint + "/v1",
+            http_client=http_client,
+            max_retries=0,
         )
         if args.routing_strategy is not None:
             client = client.with_options(
@@ -262,22 +343,22 @@ def main(args):
         if not args.streaming:
             logging.info("Using batch client")
             start_time = time.time()
-            asyncio.run(benchmark_batch(
+            run_event_loop(benchmark_batch(
                 client = client,
-                endpoint=args.endpoint, 
                 load_struct=load_struct, 
-                output_file=output_file, 
+                output_file=output_file,
+                max_inflight=args.max_inflight,
             ))
             end_time = time.time()
             logging.info(f"Benchmark completed in {end_time - start_time:.2f} seconds")
         else:
             logging.info("Using streaming client")
             start_time = time.time()
-            asyncio.run(benchmark_streaming(
+            run_event_loop(benchmark_streaming(
                 client = client,
-                endpoint=args.endpoint, 
                 load_struct=load_struct, 
                 output_file=output_file,
+                max_inflight=args.max_inflight,
             ))
             end_time = time.time()
             logging.info(f"Benchmark completed in {end_time - start_time:.2f} seconds")
@@ -291,6 +372,10 @@ if __name__ == "__main__":
     parser.add_argument('--output-file-path', type=str, default="output.jsonl")
     parser.add_argument("--streaming", action="store_true", help="Use streaming client.")
     parser.add_argument("--routing-strategy", type=str, required=False, default=None, help="Routing strategy to use.")
+    parser.add_argument("--max-inflight", type=int, default=None,
+                        help="Maximum number of requests in flight at once (default: no limit). Requests held back by "
+                             "the limit report the wait as queue_delay, it is not included in latency or ttft.")
+    parser.add_argument("--http2", action="store_true", help="Use HTTP/2 for https endpoints (requires httpx[http2]).")
 
     args = parser.parse_args()
     main(args)
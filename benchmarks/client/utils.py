@@ -1,14 +1,15 @@
-import json
-from typing import List, Any
+import asyncio
+import orjson
+from typing import List, Any, Callable, Dict, Optional
 
 def load_workload(input_path: str) -> List[Any]:
     load_struct = None
     if input_path.endswith(".jsonl"):
-        with open(input_path, "r") as file:
-            load_struct = [json.loads(line) for line in file]
+        with open(input_path, "rb") as file:
+            load_struct = [orjson.loads(line) for line in file]
     else:
-        with open(input_path, "r") as file:
-            load_struct = json.load(file)
+        with open(input_path, "rb") as file:
+            load_struct = orjson.loads(file.read())
     return load_struct
 
 # Function to wrap the prompt into OpenAI's chat completion message format.
@@ -20,4 +21,75 @@ def wrap_prompt_as_chat_message(prompt: str):
     :return: A list containing chat completion messages.
     """
     user_message = {"role": "user", "content": prompt}
-    return [user_message]
\ No newline at end of file
+    return [user_message]
+
+class AsyncJsonlWriter:
+    """
+    Write JSONL records from a single writer task fed through an asyncio queue.
+
+    Request coroutines only serialize and enqueue their record; the writer task
+    drains whatever is queued, up to batch_size records, into one writelines call.
+
+    :param output_file: The binary file object the records are written to.
+    :param batch_size: Maximum number of records written per writelines call.
+    :param maxsize: Maximum number of queued records before producers wait.
+    """
+    def __init__(self, output_file, batch_size: int = 128, maxsize: int = 8192):
+        self.output_file = output_file
+        self.batch_size = batch_size
+        self.maxsize = maxsize
+        self._queue: Optional[asyncio.Queue] = None
+        self._writer_task: Optional[asyncio.Task] = None
+        self._error: Optional[BaseException] = None
+        self._on_error: Optional[Callable[[], None]] = None
+
+    def start(self, on_error: Optional[Callable[[], None]] = None):
+        """
+        Start the writer task.
+
+        :param on_error: Called once if writing to the output file fails, so the
+            caller can stop waiting on requests; the error is re-raised by close().
+        """
+        self._on_error = on_error
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._writer_task = asyncio.create_task(self._drain())
+
+    async def write(self, record: Dict[str, Any]):
+        if self._error is not None:
+            # The run is already being stopped and close() raises the error;
+            # records from requests still finishing are dropped.
+            return
+        await self._queue.put(orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE))
+
+    async def close(self):
+        # None marks the end of the stream for the writer task.
+        await self._queue.put(None)
+        await self._writer_task
+        if self._error is not None:
+            raise self._error
+
+    async def _drain(self):
+        try:
+            await self._write_batches()
+        except Exception as e:
+            self._error = e
+            if self._on_error is not None:
+                self._on_error()
+            # Keep consuming so producers and close() never block on a full queue.
+            while await self._queue.get() is not None:
+                pass
+
+    async def _write_batches(self):
+        done = False
+        while not done:
+            batch = []
+            line = await self._queue.get()
+            while line is not None:
+                batch.append(line)
+                if len(batch) >= self.batch_size or self._queue.empty():
+                    break
+                line = self._queue.get_nowait()
+            done = line is None
+            if batch:
+                self.output_file.writelines(batch)
+                self.output_file.flush()
@@ -5,18 +5,15 @@ from scipy import stats
 from scipy.optimize import minimize
 
 def generate_poisson_dist(target: int, sample_size: int, smooth_window_size: int = 1) -> List[int]:
-    smoothed = []
     if target == 0:
-        for _ in range(0, sample_size):
-            smoothed.append(0)
-    else:
-        rps_list = np.random.poisson(lam=target, size=sample_size).tolist()
-        # Apply moving average smoothing
-        for i in range(len(rps_list)):
-            start = max(0, i - smooth_window_size + 1)
-            window = rps_list[start:i + 1]
-            smoothed.append(max(1, round(sum(window) / len(window))))
-    return smoothed
+        return [0] * sample_size
+    rps = np.random.poisson(lam=target, size=sample_size)
+    # Apply moving average smoothing, using prefix sums to get every trailing window at once
+    prefix_sums = np.concatenate(([0], np.cumsum(rps)))
+    idx = np.arange(sample_size)
+    start = np.maximum(0, idx - smooth_window_size + 1)
+    window_means = (prefix_sums[idx + 1] - prefix_sums[start]) / (idx - start + 1)
+    return np.maximum(1, np.round(window_means)).astype(int).tolist()
 
 def generate_token_len_from_percentiles(
     median: int,
@@ -4,7 +4,6 @@ import os
 import csv
 
 import numpy as np
-import matplotlib.pyplot as plt
 import pandas as pd
 
 from typing import List, Union, Any, Optional, Tuple, Dict
@@ -178,6 +177,9 @@ def plot_workload(workload_name: str,
         bin_size_sec (int): Size of each bin in seconds for aggregation.
         output_file (str, optional): File path to save the plot.
     """
+    # Imported here so generating a workload does not pay for loading matplotlib.
+    import matplotlib.pyplot as plt
+
     print(f"plot_workload in directory {output_dir}")
     # Convert workload data to a DataFrame
     data = []
@@ -190,23 +192,19 @@ def plot_workload(workload_name: str,
 
     df = pd.DataFrame(data, columns=["timestamp", "num_requests", "total_prompt_tokens", "total_output_tokens"])
 
-    # Define bins based on min/max timestamp
-    min_time, max_time = df["timestamp"].min(), df["timestamp"].max()
-    bins = np.arange(min_time, max_time + bin_size_sec, bin_size_sec)
-    
-    # Bin the data
-    df["time_bin"] = pd.cut(df["timestamp"], bins, labels=bins[:-1])
-
-    # Aggregate within each bin
-    # binned_df = df.groupby("time_bin").sum()
-    binned_df = df.groupby("time_bin").agg({
-        "num_requests": "sum", 
-        "total_prompt_tokens": "mean", 
-        "total_output_tokens": "mean"
-    })
+    # Bin the data into [start, start + bin_size_sec) intervals from the first timestamp
+    timestamps = df["timestamp"].to_numpy()
+    min_time = timestamps.min()
+    bin_idx = (timestamps - min_time) // bin_size_sec
+    entries_per_bin = np.bincount(bin_idx)
 
-    # Convert index back to numeric
-    binned_df.index = binned_df.index.astype(float)
+    # Aggregate within each bin: requests are summed, token counts averaged over entries
+    with np.errstate(invalid="ignore"):
+        binned_df = pd.DataFrame({
+            "num_requests": np.bincount(bin_idx, weights=df["num_requests"]),
+            "total_prompt_tokens": np.bincount(bin_idx, weights=df["total_prompt_tokens"]) / entries_per_bin,
+            "total_output_tokens": np.bincount(bin_idx, weights=df["total_output_tokens"]) / entries_per_bin,
+        }, index=(min_time + np.arange(len(entries_per_bin)) * bin_size_sec).astype(float))
     print(binned_df)
     # Plotting
     fig, (ax_qps, ax_input, ax_output) = plt.subplots(3, 1, figsize=(10, 8))
@@ -156,7 +156,7 @@ def generate_constant(prompt_file_path: str,
             input_lens=[None] * qps, 
             output_lens=[None] * qps, 
             initial_err_perc=0.1,
-            err_step=0.05
+            err_step=0.05,
             model=model,
         )
         if concurrent_reqs:  # Only add non-empty groups
@@ -311,33 +311,26 @@ def generate_from_azure_csv(file_path: str,
     logging.info(f"Start generation from time {current_time} to {end_time}")
     sharegpt_df = load_requests(dataset_path=prompt_file_path, tokenizer=tokenizer)
 
-    ts = 0
-    while current_time <= end_time:
-        # Select requests within the current time range
-        mask = (df.index >= current_time) & (df.index < current_time + time_range)
-        group = df.loc[mask]
-        input_lens = []
-        output_lens = []
-        for _, row in group.iterrows():
-            input_lens.append(int(row['ContextTokens']))
-            output_lens.append(int(row['GeneratedTokens']))
+    # Assign every request to its time range in one pass instead of masking the
+    # whole trace once per range; empty ranges never produce a group.
+    df['bucket'] = (df.index - current_time) // time_range
+    last_bucket = (end_time - current_time) // time_range
+    df = df[df['bucket'] <= last_bucket]
+    for bucket, group in df.groupby('bucket', sort=True):
+        input_lens = group['ContextTokens'].astype(int).tolist()
+        output_lens = group['GeneratedTokens'].astype(int).tolist()
         sampled_requests = sample_requests_len_range(
             df=sharegpt_df,
             num_requests=len(input_lens),
             input_lens=input_lens,
             output_lens=output_lens,
             initial_err_perc=0.1,
-            err_step=0.05
+            err_step=0.05,
             model=model,
         )
 
         if sampled_requests:  # Only add non-empty groups
-            grouped_requests.append({"timestamp": ts, "requests": sampled_requests})
-        ts += interval_ms
-        if ts > duration_ms:
-            break
-        # Move to the next time range
-        current_time += time_range
+            grouped_requests.append({"timestamp": int(bucket) * interval_ms, "requests": sampled_requests})
 
     # Save to file
     grouped_requests = make_serializable(grouped_requests)
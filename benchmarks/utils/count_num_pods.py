@@ -1,14 +1,9 @@
 from kubernetes import client, config
-import csv
-from datetime import datetime
 import argparse
 import time
 import os
-import asyncio
 
-def get_pod_status_counts(deployment_name, namespace="default"):
-   config.load_kube_config(context="ccr3aths9g2gqedu8asdg@41073177-kcu0mslcp5mhjsva38rpg")
-   v1 = client.CoreV1Api()
+def get_pod_status_counts(v1, deployment_name, namespace="default"):
    pods = v1.list_namespaced_pod(namespace)
    filtered_pods = [pod for pod in pods.items if deployment_name in pod.metadata.name]
    status_counts = {"running": 0, "pending": 0, "init": 0}
@@ -23,17 +18,12 @@ def get_pod_status_counts(deployment_name, namespace="default"):
            status_counts["init"] += 1
    return status_counts
 
-def write_to_csv(deployment_name, status_counts, filename, idx):
+def write_to_csv(deployment_name, status_counts, f_, idx):
     unixtime = time.time()
-    datetimestampe = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    asyncio_time = asyncio.get_event_loop().time()
-    file_exists = os.path.isfile(filename)
-    mode = 'a' if file_exists else 'w'
-    with open(filename, mode, newline='') as f_:
-        writer = csv.writer(f_)
-        if not file_exists:
-            writer.writerow(["Deployment", "Running", "Pending", "Init", "datetimestampe", "unixtime", "asyncio_time"])
-        writer.writerow([deployment_name, status_counts["running"], status_counts["pending"], status_counts["init"], datetimestampe, unixtime, asyncio_time])
+    datetimestampe = time.strftime("%Y-%m-%d_%H-%M-%S", time.localtime(unixtime))
+    # Same monotonic clock the asyncio event loop reports.
+    asyncio_time = time.monotonic()
+    f_.write(f'{deployment_name},{status_counts["running"]},{status_counts["pending"]},{status_counts["init"]},{datetimestampe},{unixtime},{asyncio_time}\n')
 
 def main():
     parser = argparse.ArgumentParser()
@@ -42,12 +32,20 @@ def main():
     args = parser.parse_args()
    
     filename = f"{args.output_dir}/pod_count.csv"
-    idx = 0
-    while True:
-        status_counts = get_pod_status_counts(args.deployment)
-        write_to_csv(args.deployment, status_counts, filename, idx)
-        time.sleep(1)
-        idx += 1
+    file_exists = os.path.isfile(filename)
+    # Keep the csv open for the whole run; line buffering still flushes every row.
+    with open(filename, 'a' if file_exists else 'w', buffering=1) as f_:
+        if not file_exists:
+            f_.write("Deployment,Running,Pending,Init,datetimestampe,unixtime,asyncio_time\n")
+        # Load the kubeconfig and build the API client once instead of on every poll.
+        config.load_kube_config(context="ccr3aths9g2gqedu8asdg@41073177-kcu0mslcp5mhjsva38rpg")
+        v1 = client.CoreV1Api()
+        idx = 0
+        while True:
+            status_counts = get_pod_status_counts(v1, args.deployment)
+            write_to_csv(args.deployment, status_counts, f_, idx)
+            time.sleep(1)
+            idx += 1
 
 if __name__ == "__main__":
    main()
\ No newline at end of file